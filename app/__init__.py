@@ -3,10 +3,18 @@ from pathlib import Path
 from app.view.error_handlers import register_error_handlers
 from app.view.template_filters import register_site_filters
 from app.view.site_routes import main_route
+from app.services.logger_service import LoggerService
 
 TEMPLATES_DIR = (Path(__file__).parent / "view" / "templates").resolve()
 
+# The rank form is urlencoded, where Werkzeug ignores MAX_FORM_PARTS, so the body size
+# is the only bound on it (413 before parsing). ~1000 books x rank/url/title encodes
+# to roughly 400 KB; 2 MB leaves headroom for long, non-ASCII titles.
+MAX_CONTENT_LENGTH = 2 * 1024 * 1024
+
 def create_app(config_object: str | None = None) -> Flask:
+    LoggerService.configure()
+
     app = Flask(
         __name__,
         template_folder=TEMPLATES_DIR
@@ -15,6 +23,7 @@ def create_app(config_object: str | None = None) -> Flask:
     GENERATED_DIR = Path(app.root_path).parent / "generated"
     GENERATED_DIR.mkdir(exist_ok=True)
 
+    app.config.update(MAX_CONTENT_LENGTH=MAX_CONTENT_LENGTH)
     if config_object:
         app.config.from_object(config_object)
 
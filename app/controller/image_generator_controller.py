@@ -1,15 +1,124 @@
 # services/image_generator.py
 from __future__ import annotations
 
-import hashlib
+import functools
+import mmap
 import os
 import re
-import textwrap
+import secrets
+from concurrent.futures import Future, ThreadPoolExecutor
 from io import BytesIO
-from typing import Dict, Tuple, Optional
+from typing import Callable, Dict, Tuple, Optional
 
 import requests
+import xxhash
 from PIL import Image, ImageDraw, ImageFont
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# Shared keep-alive session: covers mostly come from one or two CDN hosts, so
+# pooling connections saves a TCP+TLS handshake per cover.
+_SESSION = requests.Session()
+_SESSION.headers.update({"User-Agent": "s-tier-list/1.0 (+cover fetcher)"})
+_ADAPTER = HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=64,
+    max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504]),
+)
+_SESSION.mount("http://", _ADAPTER)
+_SESSION.mount("https://", _ADAPTER)
+
+_RANKS_BRACKET = re.compile(r"^ranks\[(?P<id>.+?)\]$")
+_RANKS_DOT = re.compile(r"^ranks\.(?P<id>.+)$")
+
+# Covers are a few hundred KB; refuse anything bigger rather than buffer it.
+MAX_COVER_BYTES = 4 * 1024 * 1024
+_DOWNLOAD_CHUNK = 64 * 1024
+
+# WebP can't encode images larger than this on either side
+WEBP_MAX_DIMENSION = 16383
+
+# Below this size a plain buffered read is cheaper than setting up an mmap.
+_MMAP_MIN_BYTES = 512 * 1024
+
+
+def _write_atomically(path: str, write: Callable[[str], None]) -> None:
+    """
+    Have write() fill a private temp file, then rename it over path so readers never
+    see a partial file. If another worker already produced path, keep theirs.
+    Best-effort: a failed write leaves the cache as it was and never raises.
+    """
+    tmp = f"{path}.tmp.{os.getpid()}.{secrets.token_hex(4)}"
+    try:
+        write(tmp)
+        if os.path.exists(path):
+            os.remove(tmp)
+        else:
+            os.replace(tmp, path)
+    except Exception:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
+def _detached_rgb(im: Image.Image, tile_h: Optional[int] = None) -> Image.Image:
+    """
+    Return an RGB image detached from its file; RGB sources are copied once, not converted.
+    With tile_h, JPEGs are DCT-downscaled during decode and the result is shrunk to tile_h tall.
+    """
+    if tile_h:
+        # Must happen before load(); no-op for non-JPEG sources
+        im.draft("RGB", (tile_h * 2, tile_h * 2))
+    if im.mode == "RGB":
+        im.load()
+        rgb = im.copy()
+    else:
+        rgb = im.convert("RGB")
+    if tile_h:
+        # Preserves aspect ratio and only ever downscales
+        rgb.thumbnail((10_000, tile_h), Image.Resampling.LANCZOS)
+    return rgb
+
+
+@functools.lru_cache(maxsize=None)
+def _font(size: int) -> ImageFont.ImageFont:
+    """Load (once per process) the label font at the given size."""
+    try:
+        return ImageFont.truetype("arial.ttf", size)
+    except Exception:
+        return ImageFont.load_default()
+
+
+def _wrap_to_width(text: str, font: ImageFont.ImageFont, max_w: int) -> list[str]:
+    """Greedy word wrap by rendered width; words too long on their own are broken by character."""
+    lines: list[str] = []
+    line = ""
+    for word in text.split():
+        candidate = f"{line} {word}" if line else word
+        if font.getlength(candidate) <= max_w:
+            line = candidate
+            continue
+        if line:
+            lines.append(line)
+        line = ""
+        for ch in word:
+            if line and font.getlength(line + ch) > max_w:
+                lines.append(line)
+                line = ""
+            line += ch
+    if line:
+        lines.append(line)
+    return lines
+
+
+@functools.lru_cache(maxsize=512)
+def _load_tile(path: str) -> Image.Image:
+    """Decode a cached, already-resized tile. Raises on failure so misses aren't cached."""
+    with Image.open(path) as im:
+        im.load()
+        return im.copy()
 
 
 class ImageGeneratorController:
@@ -25,16 +134,16 @@ class ImageGeneratorController:
         # Base cache root (shared across the app)
         self.cache_root = cache_root or os.path.join(os.path.dirname(__file__), "cover_cache")
         os.makedirs(self.cache_root, exist_ok=True)
+        # Namespace dirs already created by this process (skips a stat per cover)
+        self._ns_dir_cache: set[str] = set()
 
     # ── Utilities to parse form data ──────────────────────────────────────────
     @staticmethod
     def extract_ranks(form) -> Dict[str, str]:
         """Accepts keys like ranks[BOOK_ID] or ranks.BOOK_ID"""
         ranks: Dict[str, str] = {}
-        b = re.compile(r"^ranks\[(?P<id>.+?)\]$")
-        d = re.compile(r"^ranks\.(?P<id>.+)$")
         for k, v in form.items():
-            m = b.match(k) or d.match(k)
+            m = _RANKS_BRACKET.match(k) or _RANKS_DOT.match(k)
             if m and v:
                 ranks[m.group("id")] = str(v)
         return ranks
@@ -44,12 +153,10 @@ class ImageGeneratorController:
         """Pick up {{ book_id }}-url and {{ book_id }}-title"""
         urls, titles = {}, {}
         for k, v in form.items():
-            if k.endswith("-url"):
-                book_id = k[:-4]
-                urls[book_id] = str(v)
-            elif k.endswith("-title"):
-                book_id = k[:-6]
-                titles[book_id] = str(v)
+            if k[-4:] == "-url":
+                urls[k[:-4]] = str(v)
+            elif k[-6:] == "-title":
+                titles[k[:-6]] = str(v)
         return urls, titles
 
     # ── Cache helpers (per-namespace) ────────────────────────────────────────
@@ -58,52 +165,148 @@ class ImageGeneratorController:
         Return/create a directory for this namespace. If namespace is None, use 'shared'.
         We hash to keep it filesystem-safe and short.
         """
-        ns = "shared" if not namespace else hashlib.sha256(namespace.encode("utf-8")).hexdigest()[:16]
+        ns = "shared" if not namespace else xxhash.xxh3_64_hexdigest(namespace.encode("utf-8"))
         ns_dir = os.path.join(self.cache_root, ns)
-        os.makedirs(ns_dir, exist_ok=True)
+        if ns_dir not in self._ns_dir_cache:
+            os.makedirs(ns_dir, exist_ok=True)
+            self._ns_dir_cache.add(ns_dir)
         return ns_dir
 
-    def _cache_path(self, url: str, namespace: Optional[str]) -> str:
-        h = hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
-        return os.path.join(self._ns_dir(namespace), f"{h}.jpg")
+    @staticmethod
+    def _url_key(url: str) -> str:
+        # Non-cryptographic hash: this only keys a local cache.
+        return xxhash.xxh3_64_hexdigest(url.encode("utf-8"))
+
+    def _cache_path(self, url: str, ns_dir: str) -> str:
+        """ns_dir comes from _ns_dir(); resolve it once per request, not per cover."""
+        h = self._url_key(url)
+        return os.path.join(ns_dir, f"{h}.jpg")
+
+    def _tile_path(self, url: str, ns_dir: str, tile_h: int) -> str:
+        h = self._url_key(url)
+        return os.path.join(ns_dir, f"{h}_h{tile_h}.png")
 
     # ── IO helpers ───────────────────────────────────────────────────────────
-    def _open_rgb_copy_from_path(self, path: str) -> Optional[Image.Image]:
+    def _open_rgb_copy_from_path(self, path: str, tile_h: Optional[int] = None) -> Optional[Image.Image]:
         """Open an image from disk as an RGB *copy* (detaches file handle)."""
         try:
-            with Image.open(path) as im:
-                return im.convert("RGB").copy()
+            if os.path.getsize(path) < _MMAP_MIN_BYTES:
+                with Image.open(path) as im:
+                    return _detached_rgb(im, tile_h)
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                # Pixels must be materialized before the mapping is closed
+                with Image.open(mm) as im:
+                    return _detached_rgb(im, tile_h)
         except Exception:
             return None
 
     # ── Network/cache fetch ──────────────────────────────────────────────────
-    def fetch_cover(self, url: Optional[str], namespace: Optional[str], timeout: int = 8) -> Optional[Image.Image]:
+    @staticmethod
+    def _download_image(url: str, timeout: int) -> Optional[bytes]:
+        """
+        Stream an image body, giving up early on non-image responses or
+        anything larger than MAX_COVER_BYTES. Returns None on rejection.
+        """
+        # (connect, read) timeouts
+        with _SESSION.get(url, timeout=(3, timeout), stream=True) as r:
+            r.raise_for_status()
+            if not r.headers.get("Content-Type", "").startswith("image/"):
+                return None
+            if int(r.headers.get("Content-Length") or 0) > MAX_COVER_BYTES:
+                return None
+            buf = BytesIO()
+            for chunk in r.iter_content(_DOWNLOAD_CHUNK):
+                buf.write(chunk)
+                if buf.tell() > MAX_COVER_BYTES:
+                    return None
+            return buf.getvalue()
+
+    def fetch_cover(
+        self,
+        url: Optional[str],
+        namespace: Optional[str],
+        timeout: int = 5,
+        tile_h: Optional[int] = None,
+        ns_dir: Optional[str] = None,
+    ) -> Optional[Image.Image]:
         """
         Return a PIL.Image (RGB). Uses per-namespace disk cache.
+        If tile_h is given, the image is decoded/downscaled to at most tile_h tall.
+        Pass ns_dir (from _ns_dir) to skip resolving the namespace again.
         Falls back to None if fetch fails.
         """
         if not url:
             return None
 
-        path = self._cache_path(url, namespace)
+        path = self._cache_path(url, ns_dir or self._ns_dir(namespace))
         if os.path.exists(path):
-            im = self._open_rgb_copy_from_path(path)
+            im = self._open_rgb_copy_from_path(path, tile_h)
             if im is not None:
                 return im
 
         # Not cached or failed to open: fetch and cache
         try:
-            r = requests.get(url, timeout=timeout)
-            r.raise_for_status()
+            content = self._download_image(url, timeout)
+            if content is None:
+                return None
             # Save raw bytes to cache path
-            with open(path, "wb") as f:
-                f.write(r.content)
+            def write_raw(tmp: str) -> None:
+                with open(tmp, "wb") as f:
+                    f.write(content)
+
+            _write_atomically(path, write_raw)
             # Open from bytes (no lingering file handle)
-            with Image.open(BytesIO(r.content)) as im:
-                return im.convert("RGB").copy()
+            with Image.open(BytesIO(content)) as im:
+                return _detached_rgb(im, tile_h)
+        except Exception:
+            return None
+
+    def fetch_tile(
+        self,
+        url: Optional[str],
+        namespace: Optional[str],
+        tile_h: int,
+        ns_dir: Optional[str] = None,
+    ) -> Optional[Image.Image]:
+        """
+        Return the cover already scaled to tile_h (RGB), ready to paste.
+        Checks the in-process cache, then the on-disk tile cache, then fetch_cover.
+        Falls back to None on any failure, so one bad cover becomes a placeholder.
+        """
+        if not url:
+            return None
+        try:
+            return self._build_tile(url, namespace, tile_h, ns_dir)
         except Exception:
             return None
 
+    def _build_tile(
+        self,
+        url: str,
+        namespace: Optional[str],
+        tile_h: int,
+        ns_dir: Optional[str],
+    ) -> Optional[Image.Image]:
+        ns_dir = ns_dir or self._ns_dir(namespace)
+        path = self._tile_path(url, ns_dir, tile_h)
+        if os.path.exists(path):
+            try:
+                return _load_tile(path)
+            except Exception:
+                pass
+
+        tile = self.fetch_cover(url, namespace, tile_h=tile_h, ns_dir=ns_dir)
+        if tile is None:
+            return None
+
+        # thumbnail() never upscales; small covers still need to reach tile_h
+        w, h = tile.size
+        if h != tile_h:
+            tile = tile.resize((max(1, int(w * tile_h / float(h))), tile_h))
+
+        _write_atomically(path, lambda tmp: tile.save(tmp, format="PNG"))
+        return tile
+
     # ── Collage generator ────────────────────────────────────────────────────
     def generate_collage(
         self,
@@ -111,7 +314,47 @@ class ImageGeneratorController:
         urls: Dict[str, str],
         titles: Dict[str, str],
         cache_namespace: Optional[str] = None,
+        image_format: str = "PNG",
     ) -> BytesIO:
+        """
+        Render the collage and encode it into an in-memory buffer (PNG unless
+        image_format="WEBP" is asked for). See render_collage for the other arguments.
+        """
+        img = self.render_collage(ranks, urls, titles, cache_namespace=cache_namespace)
+        buf = BytesIO()
+        self.save_collage(img, buf, image_format)
+        buf.seek(0)
+        return buf
+
+    @staticmethod
+    def output_format(img: Image.Image, image_format: str = "WEBP") -> str:
+        """
+        The format a collage will actually be saved in: "PNG" if requested, or if the
+        canvas is too large for WebP (very large libraries), else "WEBP".
+        """
+        if image_format.upper() == "PNG" or max(img.size) > WEBP_MAX_DIMENSION:
+            return "PNG"
+        return "WEBP"
+
+    @staticmethod
+    def save_collage(img: Image.Image, fp, image_format: str = "WEBP") -> None:
+        """
+        Encode a rendered collage into any writable file object (need not be seekable).
+        image_format: "WEBP" (default, much smaller for photo collages) or "PNG";
+        see output_format for when WebP falls back to PNG.
+        """
+        if ImageGeneratorController.output_format(img, image_format) == "PNG":
+            img.save(fp, format="PNG")
+        else:
+            img.save(fp, format="WEBP", quality=88, method=6)
+
+    def render_collage(
+        self,
+        ranks: Dict[str, str],
+        urls: Dict[str, str],
+        titles: Dict[str, str],
+        cache_namespace: Optional[str] = None,
+    ) -> Image.Image:
         """
         ranks:  {book_id: tier_key}
         urls:   {book_id: cover_url}
@@ -145,29 +388,44 @@ class ImageGeneratorController:
         TILE_GAP = 10
 
         # Fonts
-        try:
-            font_label = ImageFont.truetype("arial.ttf", 36)
-            font_small = ImageFont.truetype("arial.ttf", 18)
-        except Exception:
-            font_label = ImageFont.load_default()
-            font_small = ImageFont.load_default()
-
-        # Helper to estimate row height based on how many tiles fit
-        def row_height(n_tiles: int) -> int:
-            if n_tiles == 0:
-                return TILE_H
-            usable_w = CANVAS_W - 2 * MARGIN - LABEL_W
-            approx_tile_w = int(TILE_H * 0.66) + TILE_GAP  # rough average aspect ratio
-            per_row = max(1, usable_w // approx_tile_w)
-            rows = (n_tiles + per_row - 1) // per_row
-            return rows * (TILE_H + TILE_GAP) - TILE_GAP
-
-        total_h = 2 * MARGIN + sum(row_height(len(buckets[tier])) + ROW_GAP for tier, *_ in TIERS) - ROW_GAP
-        img = Image.new("RGB", (CANVAS_W, total_h), (20, 20, 20))
-        draw = ImageDraw.Draw(img)
+        font_label = _font(36)
+        font_small = _font(18)
+
+        # Derived layout: where tiles start and roughly how many fit per row
+        X0            = MARGIN + LABEL_W + TILE_GAP
+        APPROX_TILE_W = int(TILE_H * 0.66) + TILE_GAP  # rough average aspect ratio
+        PER_ROW       = max(1, (CANVAS_W - MARGIN - X0) // APPROX_TILE_W)
 
+        # One pass: y offset of every tier band, estimated from its tile count
+        layout = []  # (tier_key, label, color, y_start)
         y = MARGIN
         for tier_key, label, color in TIERS:
+            layout.append((tier_key, label, color, y))
+            n_tiles = len(buckets[tier_key])
+            rows = max(1, (n_tiles + PER_ROW - 1) // PER_ROW)
+            y += rows * (TILE_H + TILE_GAP) - TILE_GAP + ROW_GAP
+        total_h = y - ROW_GAP + MARGIN
+
+        # Prefetch tiles concurrently (I/O-bound); painting below stays sequential
+        # since it mutates a single canvas. Dedupe by URL so repeats fetch once.
+        ns_dir = self._ns_dir(cache_namespace)
+        futures_by_url: Dict[str, Future] = {}
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            for tier_key, *_ in TIERS:
+                for book_id in buckets[tier_key]:
+                    url = urls.get(book_id)
+                    if url and url not in futures_by_url:
+                        futures_by_url[url] = pool.submit(self.fetch_tile, url, cache_namespace, TILE_H, ns_dir)
+        tiles: Dict[str, Optional[Image.Image]] = {
+            book_id: futures_by_url[urls[book_id]].result() if urls.get(book_id) else None
+            for tier_key, *_ in TIERS
+            for book_id in buckets[tier_key]
+        }
+
+        img = Image.new("RGB", (CANVAS_W, total_h), (20, 20, 20))
+        draw = ImageDraw.Draw(img)
+
+        for tier_key, label, color, y in layout:
             # Label background block
             draw.rectangle([MARGIN, y, MARGIN + LABEL_W, y + TILE_H], fill=color)
 
@@ -177,45 +435,30 @@ class ImageGeneratorController:
             draw.text((tx, ty), label, fill=(0, 0, 0), font=font_label)
 
             # Grid positions
-            x0 = MARGIN + LABEL_W + TILE_GAP
-            x, row_y = x0, y
-            usable_w = CANVAS_W - MARGIN - x0
-            per_row = max(1, usable_w // (int(TILE_H * 0.66) + TILE_GAP))
+            x, row_y = X0, y
 
             count = 0
             for book_id in buckets[tier_key]:
-                cover = self.fetch_cover(urls.get(book_id), namespace=cache_namespace)
-                if cover is None:
-                    # Fallback: draw a block with wrapped title
-                    w_guess = int(TILE_H * 0.66)
-                    block = Image.new("RGB", (w_guess, TILE_H), (40, 40, 40))
-                    d2 = ImageDraw.Draw(block)
-                    title = titles.get(book_id, book_id)
-                    lines = textwrap.wrap(title or "", width=16)
-                    ty2 = 8
-                    for ln in lines[:6]:
-                        d2.text((6, ty2), ln, fill=(230, 230, 230), font=font_small)
-                        ty2 += 20
-                    tile = block
-                else:
-                    # Scale to fixed height, keep aspect ratio
-                    w, h = cover.size
-                    scale = TILE_H / float(h)
-                    tile = cover.resize((max(1, int(w * scale)), TILE_H))
+                tile = tiles[book_id]
+                tile_w = tile.size[0] if tile is not None else int(TILE_H * 0.66)
 
                 # Wrap to next row when needed
-                if count and (x + tile.size[0] > CANVAS_W - MARGIN):
-                    x = x0
+                if count and (x + tile_w > CANVAS_W - MARGIN):
+                    x = X0
                     row_y += TILE_H + TILE_GAP
 
-                img.paste(tile, (x, row_y))
-                x += tile.size[0] + TILE_GAP
+                if tile is None:
+                    # Fallback: draw a block with wrapped title straight onto the canvas
+                    draw.rectangle([x, row_y, x + tile_w - 1, row_y + TILE_H - 1], fill=(40, 40, 40))
+                    title = titles.get(book_id, book_id)
+                    lines = _wrap_to_width(title or "", font_small, tile_w - 12)
+                    ty2 = row_y + 8
+                    for ln in lines[:6]:
+                        draw.text((x + 6, ty2), ln, fill=(230, 230, 230), font=font_small)
+                        ty2 += 20
+                else:
+                    img.paste(tile, (x, row_y))
+                x += tile_w + TILE_GAP
                 count += 1
 
-            # Advance to next tier row
-            y += row_height(len(buckets[tier_key])) + ROW_GAP
-
-        buf = BytesIO()
-        img.save(buf, format="PNG")
-        buf.seek(0)
-        return buf
+        return img
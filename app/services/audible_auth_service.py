@@ -1,13 +1,29 @@
 # services/audible_auth_service.py
 from __future__ import annotations
 
+import functools
+import json
 import os
 import hashlib
+import threading
+import time
+from collections import OrderedDict
 from typing import Optional, Tuple, Dict
 
 import audible
 
 
+# Max number of decoded auth files kept in memory (LRU)
+AUTH_CACHE_SIZE = 256
+# Seconds a built Client is handed back for the same user without re-checking the auth file
+CLIENT_CACHE_TTL = 300
+
+
+@functools.lru_cache(maxsize=4096)
+def _safe_name(username: str) -> str:
+    return hashlib.blake2b(username.encode(), digest_size=16).hexdigest()
+
+
 class AudibleAuthError(Exception):
     """Base error for Audible auth service."""
 
@@ -16,6 +32,52 @@ class PendingLoginNotFound(AudibleAuthError):
     """Raised when completing auth for a user without a pending login."""
 
 
+class InMemoryPendingLogins:
+    """Pending OTP/CVF logins held in this process (only works with a single worker)."""
+
+    def __init__(self):
+        self._data: Dict[str, Dict[str, str]] = {}
+
+    def set(self, username: str, data: Dict[str, str]) -> None:
+        self._data[username] = data
+
+    def pop(self, username: str) -> Optional[Dict[str, str]]:
+        return self._data.pop(username, None)
+
+
+class MemcachedPendingLogins:
+    """
+    Pending OTP/CVF logins shared through Memcached, so the verify request can land
+    on any worker. Entries expire on their own; losing one just means logging in again.
+    """
+
+    def __init__(self, server: str, expire: int = 600):
+        from pymemcache.client.base import PooledClient
+
+        host, _, port = server.partition(":")
+        # Pooled: one socket per concurrent caller; request threads share this instance
+        self._client = PooledClient((host, int(port or 11211)))
+        self._expire = expire
+
+    @staticmethod
+    def _key(username: str) -> str:
+        # Memcached keys can't hold arbitrary characters; usernames are emails
+        return f"pending:{_safe_name(username)}"
+
+    def set(self, username: str, data: Dict[str, str]) -> None:
+        self._client.set(self._key(username), json.dumps(data), expire=self._expire)
+
+    def pop(self, username: str) -> Optional[Dict[str, str]]:
+        key = self._key(username)
+        raw = self._client.get(key)
+        if raw is None:
+            return None
+        # Only the caller whose delete actually removed the entry gets to use it
+        if not self._client.delete(key, noreply=False):
+            return None
+        return json.loads(raw)
+
+
 class AudibleAuthService:
     """
     Service wrapper for Audible authentication flow (username/password + OTP/CVF),
@@ -30,11 +92,17 @@ class AudibleAuthService:
           # client is ready
     """
 
-    def __init__(self, auth_dir: str = "auth_files"):
+    def __init__(self, auth_dir: str = "auth_files", pending_logins=None):
         self.auth_dir = auth_dir
         os.makedirs(self.auth_dir, exist_ok=True)
-        # In-memory store for pending OTP/CVF steps
-        self._pending_logins: Dict[str, Dict[str, str]] = {}
+        # Store for pending OTP/CVF steps (in-process unless a shared one is passed)
+        self._pending_logins = pending_logins or InMemoryPendingLogins()
+        # auth_file -> (st_mtime_ns, Authenticator); reused while the file is unchanged
+        self._auth_cache: "OrderedDict[str, Tuple[int, audible.Authenticator]]" = OrderedDict()
+        # username -> (checked_at, Authenticator, Client); skips even the stat for recently
+        # seen users, and keeps the Client (and its connection pool) while the session holds
+        self._client_cache: "OrderedDict[str, Tuple[float, audible.Authenticator, audible.Client]]" = OrderedDict()
+        self._auth_cache_lock = threading.Lock()
 
     # ── Public API ────────────────────────────────────────────────────────────
 
@@ -52,15 +120,13 @@ class AudibleAuthService:
               - If already authenticated: (Client, None)
               - If verification required: (None, "verification_required")
         """
-        auth_file = self._auth_file_for(username)
-
         # If we already have a stored session, use it.
-        if os.path.exists(auth_file):
-            auth = audible.Authenticator.from_file(auth_file)
-            return audible.Client(auth), None
+        client = self._client_for(username)
+        if client is not None:
+            return client, None
 
         # Otherwise, store credentials for the verification step.
-        self._pending_logins[username] = {"password": password, "locale": locale}
+        self._pending_logins.set(username, {"password": password, "locale": locale})
         return None, "verification_required"
 
     def complete_auth(
@@ -81,10 +147,10 @@ class AudibleAuthService:
             PendingLoginNotFound: if there was no pending login for this user.
             ValueError: if code_type is invalid.
         """
-        if username not in self._pending_logins:
+        data = self._pending_logins.pop(username)
+        if data is None:
             raise PendingLoginNotFound("No pending login for this user.")
 
-        data = self._pending_logins.pop(username)
         password = data["password"]
         locale = data["locale"]
 
@@ -114,26 +180,27 @@ class AudibleAuthService:
         else:
             raise ValueError("Invalid code_type. Use 'otp' or 'cvf'.")
 
-        # Persist session for future reuse
+        # Persist session for future reuse, and keep it warm for the requests that follow
         auth.to_file(auth_file)
-        return audible.Client(auth)
+        self._invalidate_auth(auth_file, username)
+        self._store_authenticator(auth_file, os.stat(auth_file).st_mtime_ns, auth)
+        client = audible.Client(auth)
+        self._store_client(username, auth, client, time.monotonic())
+        return client
 
     def get_client_if_authenticated(self, username: str) -> Optional[audible.Client]:
         """
         Convenience: return a client if we already have a stored session, else None.
         """
-        auth_file = self._auth_file_for(username)
-        if not os.path.exists(auth_file):
-            return None
-        auth = audible.Authenticator.from_file(auth_file)
-        return audible.Client(auth)
+        return self._client_for(username)
 
     def sign_out(self, username: str) -> bool:
         """
         Remove stored session for the given user. Returns True if a session was removed.
         """
         auth_file = self._auth_file_for(username)
-        if os.path.exists(auth_file):
+        self._invalidate_auth(auth_file, username)
+        if os.path.exists(auth_file) or self._migrate_legacy_auth_file(username, auth_file):
             try:
                 os.remove(auth_file)
                 return True
@@ -141,6 +208,87 @@ class AudibleAuthService:
                 return False
         return False
 
+    def _client_for(self, username: str) -> Optional[audible.Client]:
+        """Return a Client for the user's stored session, or None if there is none."""
+        now = time.monotonic()
+        with self._auth_cache_lock:
+            cached = self._client_cache.get(username)
+            if cached is not None and now - cached[0] < CLIENT_CACHE_TTL:
+                return cached[2]
+
+        auth_file = self._auth_file_for(username)
+        auth = self._load_authenticator(auth_file)
+        if auth is None and self._migrate_legacy_auth_file(username, auth_file):
+            auth = self._load_authenticator(auth_file)
+        if auth is None:
+            with self._auth_cache_lock:
+                self._client_cache.pop(username, None)
+            return None
+
+        # Same session as before: keep the existing Client and its open connections
+        client = cached[2] if cached is not None and cached[1] is auth else audible.Client(auth)
+        self._store_client(username, auth, client, now)
+        return client
+
+    def _store_client(
+        self,
+        username: str,
+        auth: audible.Authenticator,
+        client: audible.Client,
+        checked_at: float,
+    ) -> None:
+        # Dropped clients are not closed here: another request may still be using one,
+        # and its connection pool is released once the last reference goes away
+        with self._auth_cache_lock:
+            self._client_cache[username] = (checked_at, auth, client)
+            self._client_cache.move_to_end(username)
+            while len(self._client_cache) > AUTH_CACHE_SIZE:
+                self._client_cache.popitem(last=False)
+
+    def _load_authenticator(self, auth_file: str) -> Optional[audible.Authenticator]:
+        """
+        Return the Authenticator stored in auth_file, or None if there is none.
+        Decoded files are cached and reused for as long as their mtime is unchanged.
+        """
+        try:
+            mtime_ns = os.stat(auth_file).st_mtime_ns
+        except FileNotFoundError:
+            self._invalidate_auth(auth_file)
+            return None
+
+        with self._auth_cache_lock:
+            cached = self._auth_cache.get(auth_file)
+            if cached is not None and cached[0] == mtime_ns:
+                self._auth_cache.move_to_end(auth_file)
+                return cached[1]
+
+        auth = audible.Authenticator.from_file(auth_file)
+        self._store_authenticator(auth_file, mtime_ns, auth)
+        return auth
+
+    def _store_authenticator(self, auth_file: str, mtime_ns: int, auth: audible.Authenticator) -> None:
+        with self._auth_cache_lock:
+            self._auth_cache[auth_file] = (mtime_ns, auth)
+            self._auth_cache.move_to_end(auth_file)
+            while len(self._auth_cache) > AUTH_CACHE_SIZE:
+                self._auth_cache.popitem(last=False)
+
+    def _invalidate_auth(self, auth_file: str, username: Optional[str] = None) -> None:
+        with self._auth_cache_lock:
+            self._auth_cache.pop(auth_file, None)
+            if username is not None:
+                self._client_cache.pop(username, None)
+
+    def _migrate_legacy_auth_file(self, username: str, auth_file: str) -> bool:
+        """Move a session stored under the old SHA-256 file name to auth_file."""
+        legacy_name = hashlib.sha256(username.encode()).hexdigest()
+        legacy_file = os.path.join(self.auth_dir, f"auth_{legacy_name}.json")
+        try:
+            os.replace(legacy_file, auth_file)
+        except FileNotFoundError:
+            return False
+        return True
+
     def _auth_file_for(self, username: str) -> str:
-        safe_name = hashlib.sha256(username.encode()).hexdigest()
+        safe_name = _safe_name(username)
         return os.path.join(self.auth_dir, f"auth_{safe_name}.json")
@@ -1,13 +1,17 @@
 import logging
 
+_LOGGER = logging.getLogger("app")
+
 class LoggerService:
 
     @staticmethod
-    def get_logger():
+    def configure():
+        """Configure root logging once, at app startup (see create_app)."""
         logging.basicConfig(
             level=logging.DEBUG,  # Change to INFO if you want less noise
             format="%(asctime)s [%(levelname)s] %(message)s"
         )
 
-        logger = logging.getLogger(__name__)
-        return logger
+    @staticmethod
+    def get_logger():
+        return _LOGGER
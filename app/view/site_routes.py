@@ -1,22 +1,43 @@
-import json
-import secrets
+import base64
+import functools
+import os
+import threading
 import zipfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
 from datetime import datetime, timezone
+import orjson
+from cachetools import TTLCache
 from app.services.logger_service import LoggerService
-from app.services.audible_auth_service import AudibleAuthService
+from app.services.audible_auth_service import AudibleAuthService, MemcachedPendingLogins
 from app.controller.image_generator_controller import ImageGeneratorController
 from flask import Blueprint, render_template, request, send_file, abort, url_for, redirect
 from pathlib import Path
 
 main_route = Blueprint("home", __name__)
+logger = LoggerService.get_logger()
 
-auth = AudibleAuthService()
-controller = ImageGeneratorController(Path(main_route.root_path).parent / "cover_cache")
 
-GENERATED_DIR = Path(main_route.root_path).parent / "generated"
-GENERATED_DIR.mkdir(exist_ok=True)
+# Services are built on first use so importing the blueprint doesn't touch disk
+@functools.cache
+def _auth() -> AudibleAuthService:
+    # Share pending OTP/CVF logins across workers when Memcached is available
+    memcached_server = os.environ.get("MEMCACHED_SERVER")  # e.g. "localhost:11211"
+    return AudibleAuthService(
+        pending_logins=MemcachedPendingLogins(memcached_server) if memcached_server else None,
+    )
+
+
+@functools.cache
+def _controller() -> ImageGeneratorController:
+    return ImageGeneratorController(Path(main_route.root_path).parent / "cover_cache")
+
 
-print(GENERATED_DIR)
+@functools.cache
+def _generated_dir() -> Path:
+    generated_dir = Path(main_route.root_path).parent / "generated"
+    generated_dir.mkdir(exist_ok=True)
+    return generated_dir
 
 
 @main_route.route("/", methods=["GET", "POST"])
@@ -25,7 +46,7 @@ def login():
         username = request.form.get("username")
         password = request.form.get("password")
 
-        client, status = auth.start_auth(username, password)
+        client, status = _auth().start_auth(username, password)
 
         if status == "verification_required":
             # Redirect to OTP/CVF entry page
@@ -46,29 +67,12 @@ def verify(username):
         code_type = request.form.get("code_type", "otp").lower()
 
         try:
-            client = auth.complete_auth(username, code, code_type)
+            client = _auth().complete_auth(username, code, code_type)
 
-            library = client.get(
-                "library",
-                num_results=999,
-                response_groups="product_desc,product_attrs,media,contributors,relationships"
-            )
+            # Cheap probe so a session that can't read the library fails verification here
+            client.get("library", num_results=1)
 
-            profile = library.get("profile", {})
-
-            # Build HTML string from profile
-            html_output = []
-            for key, value in profile.items():
-                for item in value:
-                    html_output.append("<div>")
-                    html_output.append(f"<h1><span class='title'>{item.get('publication_name', '')}</span></h1>")
-                    html_output.append(f"<span class='summary'>{item.get('merchandising_summary', '')}</span><br />")
-                    html_output.append("<pre>" + json.dumps(item, indent=2, ensure_ascii=False, default=str) + "</pre>")
-                    html_output.append("</div>")
-
-            final_html = "\n".join(html_output)
-
-            print(">>> Hitting verify route and rendering success.html with test=1")
+            logger.debug("verify route hit, rendering success.html")
             return render_template("success.html", test='1')
 
         except Exception as e:
@@ -76,17 +80,75 @@ def verify(username):
 
     return render_template("verify.html", username=username)
 
+REWARD_ZIP_NAME = "litrpg_rank_reward.zip"
+
+# token -> ZIP bytes for recently generated rewards, bounded by total bytes. Downloads
+# usually follow within seconds, so most are served without touching disk; the copy
+# in the generated dir covers other workers and anything evicted or expired.
+_zip_cache = TTLCache(maxsize=64 * 1024 * 1024, ttl=600, getsizeof=len)
+_zip_cache_lock = threading.Lock()
+
+# The disk copy is written off the request thread; token -> write still in flight
+_pending_zips: dict[str, Future] = {}
+
+
+@functools.cache
+def _zip_writer() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="reward-zip")
+
+
+def _persist_zip(zip_path: Path, data: bytes) -> None:
+    # Write then rename so other workers never serve a half-written archive
+    tmp_path = zip_path.with_suffix(".zip.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, zip_path)
+
+
+def _zip_persisted(token: str, future: Future) -> None:
+    _pending_zips.pop(token, None)
+    exc = future.exception()
+    if exc is not None:
+        logger.error(f"writing reward zip {token} failed: {exc!r}")
+
+
+def _image_entry_name(image_format: str) -> str:
+    return f"litrpg_tier_list.{image_format.lower()}"
+
+
+def _write_reward_zip(zf: zipfile.ZipFile, img, image_format: str, snapshot: dict) -> None:
+    """Add the collage and the submission snapshot to an open archive."""
+    # Encode straight into the archive (no intermediate buffer). The image is
+    # already compressed; deflating it again only burns CPU.
+    image_info = zipfile.ZipInfo(
+        _image_entry_name(image_format),
+        date_time=datetime.now().timetuple()[:6],
+    )
+    image_info.compress_type = zipfile.ZIP_STORED
+    with zf.open(image_info, mode="w", force_zip64=False) as dst:
+        ImageGeneratorController.save_collage(img, dst, image_format)
+    zf.writestr(
+        "submission.json",
+        orjson.dumps(snapshot, option=orjson.OPT_INDENT_2),
+        compress_type=zipfile.ZIP_DEFLATED,
+        compresslevel=1,
+    )
+
+
 @main_route.post("/generate-rank-image")
 def generate_rank_image():
     if not request.form:
         abort(400, "No form data received")
 
+    controller = _controller()
     ranks = controller.extract_ranks(request.form)
+    urls, titles = controller.extract_meta(request.form)
     if not ranks:
         abort(400, "No ranks selected")
 
-    urls, titles = controller.extract_meta(request.form)
-    png = controller.generate_collage(ranks, urls, titles)  # BytesIO
+    # WebP unless the client explicitly asks for PNG
+    image_format = "PNG" if request.form.get("image_format", "").lower() == "png" else "WEBP"
+    img = controller.render_collage(ranks, urls, titles)  # PIL.Image
+    image_format = controller.output_format(img, image_format)
 
     # Build JSON snapshot of what the user submitted
     snapshot = {
@@ -96,29 +158,65 @@ def generate_rank_image():
         "titles": titles,
     }
 
-    # Create a unique token + write a ZIP to disk
-    token = secrets.token_urlsafe(16)
-    zip_path = GENERATED_DIR / f"{token}.zip"
-
-    with zipfile.ZipFile(zip_path, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
-        zf.writestr("litrpg_tier_list.png", png.getvalue())
-        zf.writestr("submission.json", json.dumps(snapshot, indent=2))
+    # Create a unique token + build the ZIP; keep it in memory and on disk
+    token = base64.urlsafe_b64encode(os.urandom(12)).decode()
+    zip_path = _generated_dir() / f"{token}.zip"
+
+    # Entries are stored uncompressed unless they opt in (only the small JSON does)
+    buf = BytesIO()
+    with zipfile.ZipFile(buf, mode="w", compression=zipfile.ZIP_STORED) as zf:
+        _write_reward_zip(zf, img, image_format, snapshot)
+    data = buf.getvalue()
+    # An archive bigger than the whole cache can't be cached (TTLCache raises); disk only
+    if len(data) <= _zip_cache.maxsize:
+        with _zip_cache_lock:
+            _zip_cache[token] = data
+    future = _zip_writer().submit(_persist_zip, zip_path, data)
+    _pending_zips[token] = future
+    future.add_done_callback(functools.partial(_zip_persisted, token))
 
     # Render reward page with link to download
     return render_template(
         "reward.html",
         download_url=url_for("home.download_package", token=token),
+        image_name=_image_entry_name(image_format),
     )
 
 @main_route.get("/download/<token>")
 def download_package(token: str):
-    zip_path = GENERATED_DIR / f"{token}.zip"
-    if not zip_path.exists():
+    with _zip_cache_lock:
+        data = _zip_cache.get(token)
+    if data is not None:
+        return _send_reward_zip(BytesIO(data), token)
+
+    # Evicted from memory before its disk copy landed: wait for the write
+    pending = _pending_zips.get(token)
+    if pending is not None:
+        try:
+            pending.result()
+        except OSError:
+            pass  # already logged by _zip_persisted; the disk lookup below 404s
+
+    zip_path = _generated_dir() / f"{token}.zip"
+    # Stream the ZIP; change name if you want a timestamp. Passing a real path (not a
+    # file object) lets Werkzeug hand it to the server's wsgi.file_wrapper, which
+    # gunicorn serves with sendfile(2), or to the front proxy when USE_X_SENDFILE is on.
+    # send_file stats the path itself, so a missing archive surfaces here.
+    try:
+        return _send_reward_zip(str(zip_path), token)
+    except FileNotFoundError:
         abort(404)
-    # Stream the ZIP; change name if you want a timestamp
+
+
+def _send_reward_zip(source, token: str):
+    # A token's archive never changes, so the token itself is a strong ETag: retries
+    # and segmented downloads get a 304 without the body being read again.
     return send_file(
-        str(zip_path),
+        source,
         mimetype="application/zip",
         as_attachment=True,
-        download_name="litrpg_rank_reward.zip",
+        download_name=REWARD_ZIP_NAME,
+        conditional=True,
+        etag=token,
+        max_age=600,
     )
\ No newline at end of file
@@ -1,26 +1,48 @@
 
-import json
+import functools
+import orjson
 from app.services.logger_service import LoggerService
 from jinja2.runtime import Undefined
 from datetime import datetime
 
+
+@functools.lru_cache(maxsize=1024)
+def _parse_json(s: str):
+    """
+    Parse a JSON string; templates often filter the same value repeatedly.
+    The cached object is shared by every caller with the same input: treat it as read-only.
+    """
+    return orjson.loads(s)
+
+
+@functools.lru_cache(maxsize=2048)
+def _parse_iso(s: str) -> datetime:
+    """Parse an ISO-8601 timestamp; the same dates repeat across a library page."""
+    if s.endswith("Z"):
+        s = s[:-1] + "+00:00"
+    return datetime.fromisoformat(s)
+
+
 def register_site_filters(app):
+    logger = LoggerService.get_logger()
+
     @app.template_filter("from_json")
     def from_json_filter(s):
-        logger = LoggerService.get_logger()
+        # Parsed values are cached and shared across renders; don't mutate them in templates
+        if s is None or s == "" or isinstance(s, Undefined):
+            return {}
+        if isinstance(s, dict):
+            return s
         try:
-            if s is None or isinstance(s, Undefined):
-                return {}
-            if isinstance(s, dict):
-                return s
-            return json.loads(s)
+            if isinstance(s, str):
+                return _parse_json(s)
+            return orjson.loads(s)
         except Exception as e:
             logger.error(f"from_json error: {e}")
             return {}
         
     @app.template_filter("to_hours")
     def to_hours_filter(s):
-        logger = LoggerService.get_logger()
         try:
             total_minutes = int(s)  # ensure it's an integer
             hours = total_minutes // 60
@@ -37,11 +59,11 @@ def register_site_filters(app):
     def format_iso(value, fmt="%b %d, %Y %I:%M %p"):
         if isinstance(value, str):
             try:
-                value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+                value = _parse_iso(value)
             except ValueError:
                 return value  # return as-is if parsing fails
         return value.strftime(fmt)
 
     @app.template_filter('pretty_json')
     def pretty_json(value):
-        return json.dumps(value, indent=4, sort_keys=True)
\ No newline at end of file
+        return orjson.dumps(value, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS).decode()
\ No newline at end of file